@@ -1,11 +1,14 @@
-import json
+from dataclasses import replace
+from functools import lru_cache
 
 import flask
-import plotly
+import pandas as pd
+import plotly.io as pio
+from flask_caching import Cache
 from flask_socketio import SocketIO
 
 from covid_analysis.auxiliary_data_analysis import (
-    AuxiliaryDataHolder,
+    AUXILIARY_DATA,
     plot_mobility_and_government_data,
 )
 from covid_analysis.config_utils import ProcessingConfigHolder
@@ -14,7 +17,7 @@ from covid_analysis.data_analysis import (
     process_covid_data,
     plot_data_per_country,
 )
-from covid_analysis.data_utils import LatestCovidData
+from covid_analysis.data_utils import get_latest_covid_data
 from covid_analysis.gmm_modelling import predict_peaks_using_gmm, plot_peaks
 from covid_analysis.plotting_utils import construct_y_axis_title
 from covid_analysis.weekend_effect_analysis import (
@@ -29,19 +32,69 @@ from .forms import (
 )
 
 app = flask.Flask(__name__)
+cache = Cache(app, config={'CACHE_TYPE': 'SimpleCache', 'CACHE_DEFAULT_TIMEOUT': 3600})
 socketio = SocketIO(app)
 
-LATEST_COVID_DATA = LatestCovidData()
 BASE_PROCESSING_CONFIG = ProcessingConfigHolder()
 RESPONSE_MAP = {'No': False, 'Yes': True}
-COVID_DATA_MAP = {
-    'infections': LATEST_COVID_DATA.cases_data,
-    'deaths': LATEST_COVID_DATA.deaths_data,
-    'recoveries': LATEST_COVID_DATA.recovered_data,
-    'active cases': LATEST_COVID_DATA.active_data,
-    'tests': LATEST_COVID_DATA.testing_data
+# The data is looked up by attribute name, so that it is only loaded when required
+COVID_DATA_ATTRIBUTE_MAP = {
+    'infections': 'cases_data',
+    'deaths': 'deaths_data',
+    'recoveries': 'recovered_data',
+    'active cases': 'active_data',
+    'tests': 'testing_data',
 }
-AUXILIARY_DATA = AuxiliaryDataHolder()
+
+
+@lru_cache(maxsize=64)
+def get_processed_covid_data(processing_config: ProcessingConfigHolder) -> pd.DataFrame:
+    """
+    Processes the COVID data of the type given in the processing config. The
+    processed data only depends on the (hashable) processing config, so it is cached
+    and shared between requests with the same config.
+    """
+    covid_data = getattr(
+        get_latest_covid_data(),
+        COVID_DATA_ATTRIBUTE_MAP[processing_config.covid_data_type],
+    )
+    return process_covid_data(covid_data, processing_config)
+
+
+@cache.memoize()
+def get_country_figure(
+    country_name: str,
+    processing_config: ProcessingConfigHolder,
+) -> str:
+    """
+    Constructs the serialised figure for a given country. The figure only depends on
+    the country and the processing config, so it is cached for repeated requests.
+    """
+    country_figure = get_country_data(
+        get_latest_covid_data(),
+        country_name,
+        processing_config,
+    )
+    return pio.to_json(country_figure, validate=False, engine='orjson')
+
+
+@cache.memoize()
+def get_peak_predictions_figure(processing_config: ProcessingConfigHolder) -> str:
+    """
+    Constructs the serialised figure with the peak predictions. The figure only
+    depends on the processing config, so it is cached for repeated requests.
+    """
+    covid_data = get_processed_covid_data(processing_config)
+    plot_data = predict_peaks_using_gmm(
+        covid_data,
+        country_set=processing_config.country_set,
+    )
+    y_axis_title = construct_y_axis_title(
+        'infections',
+        processing_config,
+    )
+    peaks_figure = plot_peaks(plot_data, y_axis_title=y_axis_title)
+    return pio.to_json(peaks_figure, validate=False, engine='orjson')
 
 
 @app.route('/', methods=['GET', 'POST'])
@@ -66,22 +119,18 @@ def get_single_country_data(country_name: str):
     Gets all the data (deaths, infections, recoveries and active cases)
     for a given country
     """
-    processing_config = ProcessingConfigHolder()
+    processing_config = BASE_PROCESSING_CONFIG
     form = CountryDataFormatForm()
 
     if form.validate_on_submit():
-        processing_config.get_daily_change = RESPONSE_MAP[form.daily_changes.data]
-        processing_config.get_rolling_average = RESPONSE_MAP[form.rolling_average.data]
-        processing_config.normalise_by_population = (
-            RESPONSE_MAP[form.population_normaliser.data]
+        processing_config = replace(
+            processing_config,
+            get_daily_change=RESPONSE_MAP[form.daily_changes.data],
+            get_rolling_average=RESPONSE_MAP[form.rolling_average.data],
+            normalise_by_population=RESPONSE_MAP[form.population_normaliser.data],
         )
 
-    country_figure = get_country_data(
-        LATEST_COVID_DATA,
-        country_name,
-        processing_config,
-    )
-    country_figure = json.dumps(country_figure, cls=plotly.utils.PlotlyJSONEncoder)
+    country_figure = get_country_figure(country_name, processing_config)
     return flask.render_template(
         'country_graph_template.html',
         plot=country_figure,
@@ -97,29 +146,22 @@ def get_peak_predictions():
     Gets the predictions of the peaks in various countries. Peaks are predicted using
     a GMM model
     """
-    processing_config = ProcessingConfigHolder()
-    processing_config.country_set = ['Belgium', 'United Kingdom', 'US']
+    processing_config = replace(
+        BASE_PROCESSING_CONFIG,
+        country_set=('Belgium', 'United Kingdom', 'US'),
+    )
     form = PeakPredictionSelectionForm()
 
     if form.validate_on_submit():
-        processing_config.country_set = form.countries.data
-        processing_config.get_daily_change = RESPONSE_MAP[form.daily_changes.data]
-        processing_config.get_rolling_average = RESPONSE_MAP[form.rolling_average.data]
-        processing_config.normalise_by_population = RESPONSE_MAP[
-            form.population_normaliser.data
-        ]
+        processing_config = replace(
+            processing_config,
+            country_set=tuple(form.countries.data),
+            get_daily_change=RESPONSE_MAP[form.daily_changes.data],
+            get_rolling_average=RESPONSE_MAP[form.rolling_average.data],
+            normalise_by_population=RESPONSE_MAP[form.population_normaliser.data],
+        )
 
-    covid_data = process_covid_data(LATEST_COVID_DATA.cases_data, processing_config)
-    plot_data = predict_peaks_using_gmm(
-        covid_data,
-        country_set=processing_config.country_set,
-    )
-    y_axis_title = construct_y_axis_title(
-        'infections',
-        processing_config,
-    )
-    peaks_figure = plot_peaks(plot_data, y_axis_title=y_axis_title)
-    peaks_figure = json.dumps(peaks_figure, cls=plotly.utils.PlotlyJSONEncoder)
+    peaks_figure = get_peak_predictions_figure(processing_config)
     return flask.render_template(
         'graph_template.html',
         plot=peaks_figure,
@@ -136,29 +178,25 @@ def get_country_comparisons():
     the comparison of deaths per million people across a range of countries (which
     can be selected by the user)
     """
-    processing_config = ProcessingConfigHolder()
-    processing_config.num_presort_countries = 50
+    processing_config = replace(BASE_PROCESSING_CONFIG, num_presort_countries=50)
     form = MultipleCountryDataForm()
-    base_covid_data = LATEST_COVID_DATA.cases_data
     if form.validate_on_submit():
-        processing_config.get_daily_change = RESPONSE_MAP[form.daily_changes.data]
-        processing_config.get_rolling_average = RESPONSE_MAP[form.rolling_average.data]
-        processing_config.normalise_by_population = RESPONSE_MAP[
-            form.population_normaliser.data
-        ]
-        processing_config.threshold = (
-            10 if form.adjust_for_time_diff.data == 'Yes' else None
+        processing_config = replace(
+            processing_config,
+            get_daily_change=RESPONSE_MAP[form.daily_changes.data],
+            get_rolling_average=RESPONSE_MAP[form.rolling_average.data],
+            normalise_by_population=RESPONSE_MAP[form.population_normaliser.data],
+            threshold=10 if form.adjust_for_time_diff.data == 'Yes' else None,
+            covid_data_type=form.data_type.data,
         )
-        processing_config.covid_data_type = form.data_type.data
-        base_covid_data = COVID_DATA_MAP[form.data_type.data]
 
-    covid_data = process_covid_data(base_covid_data, processing_config)
+    covid_data = get_processed_covid_data(processing_config)
     covid_figure = plot_data_per_country(
         covid_data,
         processing_config,
         num_countries=10,
     )
-    covid_figure = json.dumps(covid_figure, cls=plotly.utils.PlotlyJSONEncoder)
+    covid_figure = pio.to_json(covid_figure, validate=False, engine='orjson')
     return flask.render_template(
         'country_graph_template.html',
         plot=covid_figure,
@@ -175,6 +213,7 @@ def get_country_comparisons():
 
 
 @app.route('/mobility_and_government_data/<string:country_name>', methods=['GET'])
+@cache.cached()
 def get_mobility_and_government_data(country_name: str):
     """
     Gets the mobility and government data for a given country. The mobility data
@@ -182,7 +221,7 @@ def get_mobility_and_government_data(country_name: str):
     data shows how stringent the government measures in force are.
     """
     mobility_figure = plot_mobility_and_government_data(AUXILIARY_DATA, country_name)
-    mobility_figure = json.dumps(mobility_figure, cls=plotly.utils.PlotlyJSONEncoder)
+    mobility_figure = pio.to_json(mobility_figure, validate=False, engine='orjson')
     return flask.render_template(
         'aux_data_template.html',
         plot=mobility_figure,
@@ -191,20 +230,24 @@ def get_mobility_and_government_data(country_name: str):
 
 
 @app.route('/weekend_effect_data/<string:country_name>', methods=['GET'])
+@cache.cached()
 def get_weekend_effect_data(country_name: str):
     """
     Gets the weekend effect data for a given country. This shows the differences in
     report during (and shortly after) weekends, relative to the rest of the week.
     """
-    weekend_effect_data = analyse_weekend_effects(LATEST_COVID_DATA.deaths_data)
+    weekend_effect_data = analyse_weekend_effects(
+        get_latest_covid_data().deaths_data,
+    )
     weekend_effect_figure = plot_weekend_effect_data(
         weekend_effect_data,
         country_name,
         'deaths',
     )
-    weekend_effect_figure = json.dumps(
+    weekend_effect_figure = pio.to_json(
         weekend_effect_figure,
-        cls=plotly.utils.PlotlyJSONEncoder,
+        validate=False,
+        engine='orjson',
     )
     return flask.render_template(
         'aux_data_template.html',
@@ -3,22 +3,23 @@ from functools import lru_cache
 from flask_wtf import FlaskForm
 from wtforms import RadioField, SelectField, SubmitField, SelectMultipleField
 
-from covid_analysis.data_utils import fetch_latest_cases_data, preprocess_covid_data
+from covid_analysis.data_utils import get_latest_covid_data
 
 YES_NO_CHOICES = [('Yes', 'Yes'), ('No', 'No')]
 
 
 @lru_cache(maxsize=1)
 def get_available_countries():
-    covid_data = fetch_latest_cases_data()
-    covid_data = preprocess_covid_data(covid_data)
-    return list(covid_data.index)
+    return tuple(sorted(get_latest_covid_data().cases_data.index))
+
+
+@lru_cache(maxsize=1)
+def get_country_choices():
+    return tuple((country, country) for country in get_available_countries())
 
 
 class CountrySelectionForm(FlaskForm):
-    countries = get_available_countries()
-    country_choices = [tuple([country, country]) for country in countries]
-    country = SelectField('Country', choices=country_choices)
+    country = SelectField('Country')
     analysis_type = RadioField(
         'Type of analysis',
         choices=[
@@ -30,6 +31,12 @@ class CountrySelectionForm(FlaskForm):
     )
     submit = SubmitField('Submit selection!')
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # The choices are set here (rather than in the class body) so that the COVID
+        # data is only loaded when a form is first used, not when the app is imported
+        self.country.choices = get_country_choices()
+
 
 class CountryDataFormatForm(FlaskForm):
     daily_changes = RadioField('Daily changes', choices=YES_NO_CHOICES, default='Yes')
@@ -47,9 +54,11 @@ class CountryDataFormatForm(FlaskForm):
 
 
 class PeakPredictionSelectionForm(CountryDataFormatForm):
-    available_countries = get_available_countries()
-    country_choices = [tuple([country, country]) for country in available_countries]
-    countries = SelectMultipleField('Countries to plot', choices=country_choices)
+    countries = SelectMultipleField('Countries to plot')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.countries.choices = get_country_choices()
 
 
 class MultipleCountryDataForm(CountryDataFormatForm):
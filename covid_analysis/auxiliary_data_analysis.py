@@ -1,13 +1,29 @@
-import datetime as dt
 from functools import lru_cache
 
 import pandas as pd
 import plotly.graph_objects as go
 
-from .data_utils import country_name_mapper
+from .cache_utils import parquet_cache
+from .data_analysis import calculate_rolling_average
+from .data_utils import forward_fill_missing_values, map_country_names
+
+MOBILITY_DATA_URL = (
+    'https://www.gstatic.com/covid19/mobility/Global_Mobility_Report.csv?'
+    'cachebust=d09f7f6f428c6783'
+)
+MOBILITY_VARIABLES = [
+    'retail_and_recreation_percent_change_from_baseline',
+    'grocery_and_pharmacy_percent_change_from_baseline',
+    'parks_percent_change_from_baseline',
+    'transit_stations_percent_change_from_baseline',
+    'workplaces_percent_change_from_baseline',
+    'residential_percent_change_from_baseline',
+]
+GOVERNMENT_RESPONSE_VARIABLES = ['StringencyIndex']
 
 
 @lru_cache(maxsize=1)
+@parquet_cache
 def get_mobility_data(mobility_data_file_path: str) -> pd.DataFrame:
     """
     Performs pre-processing on the COVID mobility data from Google
@@ -22,82 +38,98 @@ def get_mobility_data(mobility_data_file_path: str) -> pd.DataFrame:
     pd.DataFrame
         The processed COVID mobility data
     """
-    mobility_data = pd.read_csv(mobility_data_file_path)
-    mobility_data['country_region'] = (
-        mobility_data['country_region']
-        .apply(lambda country_name: country_name_mapper.get(country_name, country_name))
-    )
-    mobility_data = mobility_data[pd.isna(mobility_data['sub_region_1'])]
-    mobility_data = mobility_data.drop(
-        ['sub_region_1', 'sub_region_2', 'country_region_code'],
-        axis=1,
+    # Only the country level data is used, so the other columns are not loaded. The
+    # region names repeat heavily, so they are read as categories, and the percentage
+    # changes do not need double precision, so they are read as float32. The dates
+    # are parsed while reading, so that they are ordered chronologically.
+    mobility_data = pd.read_csv(
+        mobility_data_file_path,
+        usecols=['country_region', 'sub_region_1', 'date'] + MOBILITY_VARIABLES,
+        dtype={
+            'country_region': 'category',
+            'sub_region_1': 'category',
+            **{variable: 'float32' for variable in MOBILITY_VARIABLES},
+        },
+        parse_dates=['date'],
+        infer_datetime_format=True,
     )
-    percent_change_cols = [
-        col for col in mobility_data.columns if 'percent_change' in col
-    ]
-    mobility_data = mobility_data.melt(
-        id_vars=['country_region', 'date'],
-        value_vars=percent_change_cols,
-    )
-    mobility_data['variable'] = (
-        mobility_data['variable'].apply(
-            lambda x: (
-                x.replace('_percent_change_from_baseline', '')
-                .replace('_', ' ')
-                .capitalize()
-            )
+    mobility_data = mobility_data[mobility_data['sub_region_1'].isna()]
+    mobility_data = mobility_data.drop('sub_region_1', axis=1)
+    mobility_data['country_region'] = map_country_names(mobility_data['country_region'])
+    # The variables are renamed as columns (rather than after melting the data into
+    # one row per variable), and the first figure is kept for any duplicated dates
+    variable_names = {
+        col: (
+            col.replace('_percent_change_from_baseline', '')
+            .replace('_', ' ')
+            .capitalize()
         )
-    )
+        for col in MOBILITY_VARIABLES
+    }
     mobility_data = (
-        mobility_data.drop_duplicates()
-        .set_index(['country_region', 'variable', 'date'])['value']
+        mobility_data.rename(columns=variable_names)
+        .set_index(['country_region', 'date'])
     )
-    mobility_data = mobility_data[~mobility_data.index.duplicated()].unstack()
-    mobility_data.columns = [
-        dt.datetime.strptime(date, '%Y-%m-%d').strftime('%-m/%-d/%y')
-        for date in mobility_data.columns
-    ]
+    mobility_data = mobility_data[~mobility_data.index.duplicated()]
+    mobility_data.columns.name = 'variable'
+    # Sorting by country allows the data for a country to be looked up with .loc
+    mobility_data = mobility_data.stack(dropna=False).unstack('date')
+    mobility_data = mobility_data.sort_index(level=0)
+    mobility_data.columns = mobility_data.columns.strftime('%-m/%-d/%y')
     return mobility_data
 
 
 @lru_cache(maxsize=1)
+@parquet_cache
 def get_government_response_data() -> pd.DataFrame:
     """
     Loads the government response data from Oxford. This data contains information
     regarding the measures taken by governments regarding COVID, such as lockdowns
-    and economic measures.
+    and economic measures. Only the variables in GOVERNMENT_RESPONSE_VARIABLES are
+    loaded.
 
     Returns
     -------
     pd.DataFrame
-        The processed government response data
+        The processed government response data, with one row per country and date
     """
     government_data = pd.read_csv(
         'https://raw.githubusercontent.com/OxCGRT/covid-policy-tracker/master/data/'
-        'OxCGRT_latest.csv'
-    )
-    government_data['CountryName'] = (
-        government_data['CountryName']
-        .apply(lambda country_name: country_name_mapper.get(country_name, country_name))
+        'OxCGRT_latest.csv',
+        usecols=['CountryName', 'Date'] + GOVERNMENT_RESPONSE_VARIABLES,
+        dtype={
+            'CountryName': 'category',
+            **{variable: 'float32' for variable in GOVERNMENT_RESPONSE_VARIABLES},
+        },
     )
-    government_data['Date'] = (
-        government_data['Date']
-        .apply(pd.to_datetime, format='%Y%m%d')
+    government_data['CountryName'] = map_country_names(government_data['CountryName'])
+    government_data['Date'] = pd.to_datetime(
+        government_data['Date'],
+        format='%Y%m%d',
+        cache=True,
     )
-    government_data['Date'] = [
-        date.strftime('%-m/%-d/%y')
-        for date in government_data['Date']
-    ]
-    cols = [
-        col for col in government_data.columns
-        if col not in ['CountryName', 'CountryCode', 'Date']
-    ]
-    government_data = (
+    return government_data
+
+
+@lru_cache(maxsize=1)
+def get_stringency_data() -> pd.DataFrame:
+    """
+    Extracts the government stringency data from the government response data. Any
+    missing dates in the data are filled by using the last available figure
+
+    Returns
+    -------
+    pd.DataFrame
+        A dataframe where the indices are the countries and the columns are the dates
+    """
+    government_data = get_government_response_data()
+    stringency_data = (
         government_data
-        .melt(id_vars=['CountryName', 'Date'], value_vars=cols)
-        .set_index(['CountryName', 'Date', 'variable'])['value']
+        .drop_duplicates(['CountryName', 'Date'])
+        .pivot(index='CountryName', columns='Date', values='StringencyIndex')
     )
-    return government_data
+    stringency_data = forward_fill_missing_values(stringency_data)
+    return stringency_data
 
 
 class AuxiliaryDataHolder:
@@ -109,19 +141,36 @@ class AuxiliaryDataHolder:
         governments regarding COVID
     mobility_data
         The COVID mobility data from Google
+    stringency_data
+        The government stringency data per country, extracted from the government
+        response data
+
+    The data is only loaded when it is first accessed (and is cached afterwards), so
+    that importing this module does not trigger the downloads.
     """
-    government_response_data = get_government_response_data()
-    mobility_data = get_mobility_data(
-        'https://www.gstatic.com/covid19/mobility/Global_Mobility_Report.csv?'
-        'cachebust=d09f7f6f428c6783'
-    )
+    @property
+    def government_response_data(self) -> pd.DataFrame:
+        return get_government_response_data()
+
+    @property
+    def mobility_data(self) -> pd.DataFrame:
+        return get_mobility_data(MOBILITY_DATA_URL)
+
+    @property
+    def stringency_data(self) -> pd.DataFrame:
+        return get_stringency_data()
+
+
+# The data holder is shared by all users of this module, so the data is only loaded
+# once per process
+AUXILIARY_DATA = AuxiliaryDataHolder()
 
 
 def process_stringency_data(
     auxiliary_data_holder: AuxiliaryDataHolder,
     country: str,
     num_rolling_average_days: int,
-) -> pd.DataFrame:
+) -> pd.Series:
     """
     Extracts the government stringency data for a given country from the government
     response data
@@ -137,27 +186,18 @@ def process_stringency_data(
 
     Returns
     -------
-    pd.DataFrame
-        A dataframe containing the processed stringency data for the country
+    pd.Series
+        A series containing the processed stringency data for the country
     """
-    government_data = auxiliary_data_holder.government_response_data
-    stringency_data = (
-        government_data[government_data.index.get_level_values(-1) == 'StringencyIndex']
-        .droplevel(-1)
-    )
-    stringency_data = stringency_data[~stringency_data.index.duplicated()].unstack()
-    stringency_data = stringency_data.reindex(
-        sorted(stringency_data.columns, key=pd.to_datetime),
-        axis=1,
-    )
-    stringency_data = stringency_data.fillna(method='ffill', axis=1)
-    country_stringency_data = stringency_data[stringency_data.index == country]
-    country_stringency_data = (
-        country_stringency_data
-        .rolling(num_rolling_average_days, axis=1)
-        .mean()
-        .T.squeeze()
-        .dropna(axis=0, how='all')
+    stringency_data = auxiliary_data_holder.stringency_data
+    # Some countries have no government response data, in which case the row is all
+    # NaN (and the plot has an empty stringency trace)
+    country_stringency_data = calculate_rolling_average(
+        stringency_data.reindex([country]).iloc[0],
+        num_rolling_average_days,
+    ).dropna()
+    country_stringency_data.index = (
+        country_stringency_data.index.strftime('%-m/%-d/%y')
     )
     return country_stringency_data
 
@@ -183,18 +223,14 @@ def process_mobility_data(
     Returns
     -------
     pd.DataFrame
-        A dataframe containing the processed mobility data for the country
+        A dataframe containing the processed mobility data for the country, where the
+        indices are the mobility variables and the columns are the dates
     """
     mobility_data = auxiliary_data_holder.mobility_data
-    country_mobility_data = mobility_data[
-        mobility_data.index.get_level_values(0) == country
-    ]
-    country_mobility_data = (
-        country_mobility_data
-        .rolling(num_rolling_average_days, axis=1)
-        .mean()
-        .dropna(axis=1, how='all')
-    )
+    country_mobility_data = calculate_rolling_average(
+        mobility_data.loc[country],
+        num_rolling_average_days,
+    ).dropna(axis=1, how='all')
     return country_mobility_data
 
 
@@ -245,12 +281,16 @@ def plot_mobility_and_government_data(
         y=country_stringency_data.values,
         name='Government stringency'
     ))
-    for idx, row in country_mobility_data.iterrows():
-        figure.add_trace(go.Scatter(
-            x=row.index,
-            y=row.values,
-            name=idx[1],
-        ))
+    # The traces are passed as plain dictionaries and added in a single call, which
+    # avoids constructing (and validating) a go.Scatter object per variable
+    mobility_dates = country_mobility_data.columns
+    figure.add_traces([
+        dict(type='scatter', x=mobility_dates, y=values, name=variable)
+        for variable, values in zip(
+            country_mobility_data.index,
+            country_mobility_data.to_numpy(),
+        )
+    ])
     title_text = (
         f'Mobility and government response data for {country} '
         f'({num_rolling_average_days} day rolling average)'
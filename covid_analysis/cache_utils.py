@@ -0,0 +1,97 @@
+import datetime as dt
+import hashlib
+import inspect
+import os
+import tempfile
+from functools import wraps
+from pathlib import Path
+from typing import Callable, Union
+
+import pandas as pd
+
+CACHE_DIR = Path.home() / '.cache' / 'covid_analysis'
+CACHE_MAX_AGE = dt.timedelta(days=1)
+# This should be increased whenever a change outside the cached functions (e.g. in a
+# helper they call) changes the layout of the cached data
+CACHE_VERSION = 1
+
+
+def is_cache_file_fresh(cache_file_path: Path) -> bool:
+    """
+    Checks whether a cache file exists and was written less than CACHE_MAX_AGE ago
+
+    Parameters
+    ----------
+    cache_file_path
+        The path of the cache file
+
+    Returns
+    -------
+    bool
+        Whether the cache file can be used
+    """
+    if not cache_file_path.exists():
+        return False
+    modified_time = dt.datetime.fromtimestamp(cache_file_path.stat().st_mtime)
+    return dt.datetime.now() - modified_time < CACHE_MAX_AGE
+
+
+def parquet_cache(
+    func: Callable[..., Union[pd.DataFrame, pd.Series]],
+) -> Callable[..., Union[pd.DataFrame, pd.Series]]:
+    """
+    Caches the data returned by a data loading function on disk as a Parquet file,
+    keyed by the name of the function and its arguments (e.g. the URL of the data).
+    Reading the columnar Parquet file is much faster than downloading and
+    re-processing the CSV data, so the processed data is reused for CACHE_MAX_AGE.
+    The key also includes CACHE_VERSION and the source code of the function, so
+    that data processed by an older version of the code is not reused.
+
+    Parameters
+    ----------
+    func
+        The function which loads and processes the data
+
+    Returns
+    -------
+    Callable[..., Union[pd.DataFrame, pd.Series]]
+        The wrapped function
+    """
+    try:
+        func_source = inspect.getsource(func)
+    except OSError:
+        func_source = func.__code__.co_code.hex()
+    key_prefix = f'{CACHE_VERSION}\n{func_source}\n'
+
+    @wraps(func)
+    def wrapper(*args):
+        cache_key = hashlib.md5((key_prefix + repr(args)).encode()).hexdigest()
+        frame_cache_path = CACHE_DIR / f'{func.__name__}_{cache_key}.parquet'
+        series_cache_path = CACHE_DIR / f'{func.__name__}_{cache_key}.series.parquet'
+        if is_cache_file_fresh(frame_cache_path):
+            return pd.read_parquet(frame_cache_path)
+        if is_cache_file_fresh(series_cache_path):
+            return pd.read_parquet(series_cache_path).iloc[:, 0]
+
+        data = func(*args)
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        # Parquet only stores dataframes, so series are stored as a single column
+        if isinstance(data, pd.Series):
+            cache_path, frame = series_cache_path, data.to_frame()
+        else:
+            cache_path, frame = frame_cache_path, data
+        # The data is written to a temporary file which is then moved into place, so
+        # that other processes never read a partially written cache file
+        file_descriptor, temporary_path = tempfile.mkstemp(
+            dir=CACHE_DIR,
+            suffix='.tmp',
+        )
+        os.close(file_descriptor)
+        try:
+            frame.to_parquet(temporary_path, compression='zstd')
+            os.replace(temporary_path, cache_path)
+        except BaseException:
+            os.remove(temporary_path)
+            raise
+        return data
+    return wrapper
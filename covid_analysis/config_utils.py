@@ -1,8 +1,8 @@
 from dataclasses import dataclass
-from typing import List, Optional
+from typing import Optional, Tuple
 
 
-@dataclass
+@dataclass(frozen=True)
 class ProcessingConfigHolder:
     """
     A class holding the config used to process the COVID data, namely:
@@ -25,7 +25,13 @@ class ProcessingConfigHolder:
         The (optional) threshold used to adjust the data. If this is 10, the data will
         be normalised relative to the 10th death/infection/recovery
     country_set
-        An optional list of countries that should be displayed
+        An optional tuple of countries that should be displayed. If this is given,
+        only the data for these countries is processed (so any pre-sorting only
+        considers these countries).
+
+    The config is frozen (and therefore hashable), so that it can be used as a key
+    when caching the processed data. Modified configs can be created with
+    dataclasses.replace.
     """
     covid_data_type: str = 'infections'
     get_daily_change: bool = True
@@ -34,4 +40,4 @@ class ProcessingConfigHolder:
     num_rolling_average_days: int = 7
     num_presort_countries: Optional[int] = None
     threshold: Optional[int] = None
-    country_set: Optional[List[str]] = None
+    country_set: Optional[Tuple[str, ...]] = None
@@ -11,14 +11,21 @@ from .data_utils import (
     extract_matching_population_data,
     LatestCovidData,
 )
+from .numba_utils import NUMBA_AVAILABLE, njit, prange
 from .plotting_utils import construct_y_axis_title
 
+try:
+    import bottleneck as bn
+except ImportError:
+    # Without bottleneck, the rolling averages are calculated with numpy
+    bn = None
+
 inflect_engine = inflect.engine()
 
 
 def normalise_by_population_count(
     covid_data: pd.DataFrame,
-    population_data: pd.DataFrame,
+    population_data: Union[pd.DataFrame, pd.Series],
 ) -> pd.DataFrame:
     """
     Normalises the COVID data by dividing the figures by the population data (where
@@ -29,22 +36,18 @@ def normalise_by_population_count(
     covid_data
         The COVID data
     population_data
-        The population data (extracted from the World Bank)
+        The population data (extracted from the World Bank), indexed by country
 
     Returns
     -------
     pd.DataFrame
         The COVID data normalised by the population data
     """
-    normalised_data = covid_data.copy()
-    for country in covid_data.index:
-        if country in population_data.index:
-            normalised_data.loc[country] = (
-                covid_data.loc[country] / population_data.loc[country].values
-            )
-        else:
-            normalised_data.loc[country] = np.nan
-    return normalised_data
+    if isinstance(population_data, pd.DataFrame):
+        population_data = population_data['2018']
+    # Countries without population data are normalised to NaN
+    population_data = population_data.reindex(covid_data.index)
+    return covid_data.div(population_data, axis=0)
 
 
 def sort_data_ascending(data: pd.DataFrame) -> pd.DataFrame:
@@ -64,6 +67,34 @@ def sort_data_ascending(data: pd.DataFrame) -> pd.DataFrame:
     return data.sort_values(data.columns[-1], ascending=False)
 
 
+def get_top_countries(data: pd.DataFrame, num_countries: int) -> pd.DataFrame:
+    """
+    Gets the data for the countries with the highest values in the last column (the
+    most recent data), sorted in the same way as sort_data_ascending. Only these
+    countries are sorted, after partitioning the data around the last of them.
+
+    Parameters
+    ----------
+    data
+        The data from which to select the countries
+    num_countries
+        The number of countries to select
+
+    Returns
+    -------
+    pd.DataFrame
+        The sorted data for the selected countries
+    """
+    if num_countries >= len(data):
+        return sort_data_ascending(data)
+    # Negating the values gives a descending order, where NaN values are still last
+    negated_last_values = -data.iloc[:, -1].to_numpy()
+    top_indices = np.argpartition(negated_last_values, num_countries - 1)
+    top_indices = top_indices[:num_countries]
+    top_indices = top_indices[np.argsort(negated_last_values[top_indices])]
+    return data.iloc[top_indices]
+
+
 def plot_data_per_country(
     data: pd.DataFrame,
     processing_config: ProcessingConfigHolder,
@@ -92,12 +123,22 @@ def plot_data_per_country(
         data = data.sort_values('first_nonzero_index')
         data = data.drop('first_nonzero_index', axis=1)
 
+    # The missing values of all the countries are found in one pass over the data
+    data = data[:num_countries]
+    values = data.to_numpy()
+    dates = data.columns.to_numpy()
+    is_present = ~np.isnan(values)
+
     figure = go.Figure()
-    for country in data.index[:num_countries]:
-        country_data = data.loc[country].dropna()
+    for country, country_values, country_is_present in zip(
+        data.index,
+        values,
+        is_present,
+    ):
+        country_data = country_values[country_is_present]
         x_values = (
-            list(range(len(country_data.index)))
-            if processing_config.threshold else list(country_data.index)
+            np.arange(len(country_data))
+            if processing_config.threshold else dates[country_is_present]
         )
         figure.add_trace(go.Scatter(
             x=x_values,
@@ -137,8 +178,65 @@ def calculate_daily_changes(
     Union[pd.DataFrame, pd.Series]
         The dataframe or series with the values converted to daily changes
     """
-    axis = 1 if isinstance(data, pd.DataFrame) else 0
-    return data - data.shift(1, axis=axis)
+    # The differences are taken along the dates (the last axis) in a single pass over
+    # the values, and the first date has no previous value to compare with. The
+    # output has the same memory layout as the values and keeps float32 data as such.
+    values = data.to_numpy()
+    daily_changes = np.empty_like(
+        values,
+        dtype=np.result_type(values.dtype, np.float32),
+    )
+    daily_changes[..., 0] = np.nan
+    np.subtract(values[..., 1:], values[..., :-1], out=daily_changes[..., 1:])
+    if isinstance(data, pd.DataFrame):
+        return pd.DataFrame(daily_changes, index=data.index, columns=data.columns)
+    return pd.Series(daily_changes, index=data.index, name=data.name)
+
+
+def calculate_rolling_mean(values: np.ndarray, num_days: int) -> np.ndarray:
+    """
+    Calculates a rolling mean along the last axis of an array from the cumulative
+    sums of the values, which only requires a single pass over the data. As with
+    pandas, the first num_days - 1 values and the values of any window which
+    contains a missing value are NaN.
+
+    Parameters
+    ----------
+    values
+        The array whose values should be converted to a rolling mean
+    num_days
+        The number of values to use in each window
+
+    Returns
+    -------
+    np.ndarray
+        An array of the same shape as the values, containing the rolling means
+    """
+    is_missing = np.isnan(values)
+    # A zero is prepended to the cumulative sums so that the sum of every window is
+    # the difference of two cumulative sums
+    padding = [(0, 0)] * (values.ndim - 1) + [(1, 0)]
+    cumulative_sums = np.pad(
+        np.cumsum(np.where(is_missing, 0, values), axis=-1, dtype=np.float64),
+        padding,
+    )
+    cumulative_missing = np.pad(np.cumsum(is_missing, axis=-1), padding)
+    window_sums = cumulative_sums[..., num_days:] - cumulative_sums[..., :-num_days]
+    window_missing = (
+        cumulative_missing[..., num_days:] - cumulative_missing[..., :-num_days]
+    )
+
+    rolling_means = np.full(
+        values.shape,
+        np.nan,
+        dtype=np.result_type(values.dtype, np.float32),
+    )
+    rolling_means[..., num_days - 1:] = np.where(
+        window_missing > 0,
+        np.nan,
+        window_sums / num_days,
+    )
+    return rolling_means
 
 
 def calculate_rolling_average(
@@ -160,8 +258,90 @@ def calculate_rolling_average(
     Union[pd.DataFrame, pd.Series]
         The dataframe or series with the values converted to rolling averages
     """
-    axis = 1 if isinstance(data, pd.DataFrame) else 0
-    return data.rolling(num_days, axis=axis).mean()
+    values = data.to_numpy()
+    if bn is not None:
+        # Bottleneck uses a running sum in C, so each value is only visited twice
+        rolling_means = bn.move_mean(
+            values,
+            window=num_days,
+            axis=-1,
+            min_count=num_days,
+        )
+    else:
+        rolling_means = calculate_rolling_mean(values, num_days)
+    if isinstance(data, pd.DataFrame):
+        return pd.DataFrame(rolling_means, index=data.index, columns=data.columns)
+    return pd.Series(rolling_means, index=data.index, name=data.name)
+
+
+@njit(cache=True, parallel=True)
+def process_covid_values(
+    values: np.ndarray,
+    processed_values: np.ndarray,
+    threshold: float,
+    get_daily_change: bool,
+    num_rolling_average_days: int,
+):
+    """
+    Applies the threshold, the daily changes and the rolling average to the COVID
+    data in a single pass over the values of each country. This gives the same result
+    as applying the threshold, calculate_daily_changes and calculate_rolling_average
+    one after the other, without creating the intermediate arrays.
+
+    Parameters
+    ----------
+    values
+        A 2D array with the COVID data, where the rows are the countries and the
+        columns are the dates
+    processed_values
+        An array of the same shape as the values, which the processed data is
+        written to
+    threshold
+        Values below the threshold are set to NaN (-inf gives no threshold)
+    get_daily_change
+        Whether to convert the data to daily changes
+    num_rolling_average_days
+        The number of days for which the rolling average should be calculated (1
+        gives no rolling average)
+    """
+    num_countries, num_dates = values.shape
+    for country_idx in prange(num_countries):
+        changes = np.empty(num_dates)
+        previous_value = np.nan
+        for date_idx in range(num_dates):
+            value = values[country_idx, date_idx]
+            if value < threshold:
+                value = np.nan
+            if get_daily_change:
+                changes[date_idx] = value - previous_value
+                previous_value = value
+            else:
+                changes[date_idx] = value
+
+        if num_rolling_average_days == 1:
+            processed_values[country_idx] = changes
+            continue
+        # The sum and the number of missing values in the window are updated as the
+        # window moves along the dates
+        window_sum = 0.0
+        num_missing = 0
+        for date_idx in range(num_dates):
+            if np.isnan(changes[date_idx]):
+                num_missing += 1
+            else:
+                window_sum += changes[date_idx]
+            if date_idx >= num_rolling_average_days:
+                dropped_change = changes[date_idx - num_rolling_average_days]
+                if np.isnan(dropped_change):
+                    num_missing -= 1
+                else:
+                    window_sum -= dropped_change
+            if date_idx < num_rolling_average_days - 1 or num_missing > 0:
+                processed_values[country_idx, date_idx] = np.nan
+            else:
+                processed_values[country_idx, date_idx] = (
+                    window_sum / num_rolling_average_days
+                )
 
 
 def process_covid_data(
@@ -179,25 +359,57 @@ def process_covid_data(
     processing_config
         A dataclass which holds the config for processing the data
     """
-    if processing_config.threshold:
-        covid_data = covid_data[covid_data >= processing_config.threshold]
-    if processing_config.get_daily_change:
-        covid_data = calculate_daily_changes(covid_data)
-    if processing_config.get_rolling_average:
-        covid_data = calculate_rolling_average(
-            covid_data,
-            processing_config.num_rolling_average_days,
+    # The countries are selected first, so that only their data is processed
+    if processing_config.country_set:
+        covid_data = covid_data[covid_data.index.isin(processing_config.country_set)]
+    applies_per_date_processing = (
+        processing_config.threshold
+        or processing_config.get_daily_change
+        or processing_config.get_rolling_average
+    )
+    if NUMBA_AVAILABLE and applies_per_date_processing:
+        values = covid_data.to_numpy()
+        values = values.astype(np.result_type(values.dtype, np.float32), copy=False)
+        processed_values = np.empty_like(values)
+        process_covid_values(
+            values,
+            processed_values,
+            processing_config.threshold or -np.inf,
+            processing_config.get_daily_change,
+            (
+                processing_config.num_rolling_average_days
+                if processing_config.get_rolling_average else 1
+            ),
+        )
+        covid_data = pd.DataFrame(
+            processed_values,
+            index=covid_data.index,
+            columns=covid_data.columns,
         )
+    else:
+        if processing_config.threshold:
+            covid_data = covid_data[covid_data >= processing_config.threshold]
+        if processing_config.get_daily_change:
+            covid_data = calculate_daily_changes(covid_data)
+        if processing_config.get_rolling_average:
+            covid_data = calculate_rolling_average(
+                covid_data,
+                processing_config.num_rolling_average_days,
+            )
+    # The data is only sorted once, unless the normalisation changes the order
+    is_sorted = False
     if processing_config.num_presort_countries:
-        covid_data = (
-            sort_data_ascending(covid_data)[:processing_config.num_presort_countries]
+        covid_data = get_top_countries(
+            covid_data,
+            processing_config.num_presort_countries,
         )
+        is_sorted = True
     if processing_config.normalise_by_population:
         population_data = extract_matching_population_data(covid_data)
         covid_data = normalise_by_population_count(covid_data, population_data)
-    if processing_config.country_set:
-        covid_data = covid_data[covid_data.index.isin(processing_config.country_set)]
-    covid_data = sort_data_ascending(covid_data)
+        is_sorted = False
+    if not is_sorted:
+        covid_data = sort_data_ascending(covid_data)
     return covid_data
 
 
@@ -223,16 +435,18 @@ def get_country_data(
     go.Figure
         A plotly graph of the data for the country
     """
+    # Only the data for the country is processed, rather than the data for all the
+    # countries
     deaths_data = process_covid_data(
-        covid_data.deaths_data,
+        covid_data.deaths_data.loc[[country_name]],
         processing_config,
     )
     cases_data = process_covid_data(
-        covid_data.cases_data,
+        covid_data.cases_data.loc[[country_name]],
         processing_config,
     )
     recovered_data = process_covid_data(
-        covid_data.recovered_data,
+        covid_data.recovered_data.loc[[country_name]],
         processing_config,
     )
 
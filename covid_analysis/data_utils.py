@@ -1,10 +1,12 @@
-import datetime as dt
-from dataclasses import dataclass
-from functools import lru_cache
+from functools import cached_property, lru_cache
 from typing import Union
 
+import numpy as np
 import pandas as pd
 
+from .cache_utils import parquet_cache
+from .numba_utils import NUMBA_AVAILABLE, njit, prange
+
 TESTING_VAR = 'total_tests'
 
 country_name_mapper = {
@@ -38,7 +40,73 @@ data_to_drop = [
 ]
 
 
+def map_country_names(country_names: pd.Series) -> pd.Series:
+    """
+    Maps country names onto the names used in the JHU CSSE data (e.g. United States
+    to US). Names which are not in country_name_mapper are left unchanged. If the
+    names are categorical, only the categories are mapped.
+
+    Parameters
+    ----------
+    country_names
+        The country names to map
+
+    Returns
+    -------
+    pd.Series
+        The mapped country names
+    """
+    if isinstance(country_names.dtype, pd.CategoricalDtype):
+        return country_names.map(
+            lambda country_name: country_name_mapper.get(country_name, country_name)
+        )
+    return country_names.map(country_name_mapper).fillna(country_names)
+
+
+@njit(cache=True, parallel=True)
+def forward_fill_rows(values: np.ndarray):
+    """
+    Replaces the missing values in each row of a 2D array (in place) with the last
+    available value in the row
+
+    Parameters
+    ----------
+    values
+        The array whose missing values should be filled
+    """
+    for row_idx in prange(values.shape[0]):
+        last_value = np.nan
+        for column_idx in range(values.shape[1]):
+            if np.isnan(values[row_idx, column_idx]):
+                values[row_idx, column_idx] = last_value
+            else:
+                last_value = values[row_idx, column_idx]
+
+
+def forward_fill_missing_values(data: pd.DataFrame) -> pd.DataFrame:
+    """
+    Fills the missing values in the data by using the last available figure in each
+    row. Without numba, this falls back to the pandas forward fill.
+
+    Parameters
+    ----------
+    data
+        The data whose missing values should be filled, where the columns are dates
+
+    Returns
+    -------
+    pd.DataFrame
+        The data with the missing values filled
+    """
+    if not NUMBA_AVAILABLE:
+        return data.fillna(method='ffill', axis=1)
+    values = data.to_numpy(dtype=np.result_type(*data.dtypes, np.float32), copy=True)
+    forward_fill_rows(values)
+    return pd.DataFrame(values, index=data.index, columns=data.columns)
+
+
 @lru_cache(maxsize=1)
+@parquet_cache
 def fetch_latest_cases_data():
     return pd.read_csv(
         'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19'
@@ -47,6 +115,7 @@ def fetch_latest_cases_data():
 
 
 @lru_cache(maxsize=1)
+@parquet_cache
 def fetch_latest_deaths_data():
     return pd.read_csv(
         'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19'
@@ -55,6 +124,7 @@ def fetch_latest_deaths_data():
 
 
 @lru_cache(maxsize=1)
+@parquet_cache
 def fetch_latest_recovered_data():
     return pd.read_csv(
         'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19'
@@ -63,6 +133,7 @@ def fetch_latest_recovered_data():
 
 
 @lru_cache(maxsize=1)
+@parquet_cache
 def get_testing_data():
     """
     Loads the testing data from 'Our World in Data'. Any missing dates in the data are
@@ -73,10 +144,11 @@ def get_testing_data():
     pd.DataFrame
         The processed testing data
     """
+    # The OWID data has many more columns, which are not parsed
     testing_data = pd.read_csv(
-        'https://covid.ourworldindata.org/data/owid-covid-data.csv'
+        'https://covid.ourworldindata.org/data/owid-covid-data.csv',
+        usecols=['location', 'date', TESTING_VAR],
     )
-    testing_data = testing_data[['location', 'date', TESTING_VAR]]
     testing_data = testing_data.melt(
         id_vars=['location', 'date'],
         value_vars=TESTING_VAR,
@@ -84,11 +156,11 @@ def get_testing_data():
     testing_data = testing_data.set_index(['location', 'date', 'variable'])['value']
     testing_data = testing_data.unstack(level=1).droplevel(-1)
     testing_data = testing_data.dropna(axis=0, how='all')
-    testing_data.columns = [
-        dt.datetime.strptime(date, '%Y-%m-%d').strftime('%-m/%-d/%y')
-        for date in testing_data.columns
-    ]
-    testing_data = testing_data.fillna(method='ffill', axis=1)
+    testing_data.columns = (
+        pd.to_datetime(testing_data.columns, format='%Y-%m-%d')
+        .strftime('%-m/%-d/%y')
+    )
+    testing_data = forward_fill_missing_values(testing_data)
     return testing_data
 
 
@@ -105,24 +177,81 @@ def preprocess_covid_data(data: pd.DataFrame) -> pd.DataFrame:
     Returns
     -------
     pd.DataFrame
-        The processed COVID data
+        The processed COVID data, as float32 values stored in C order
     """
-    required_cols = [col for col in data.columns if col not in ['Lat', 'Long']]
-    grouped_data = data.groupby('Country/Region')[required_cols].sum()
+    # The JHU CSSE data is already ordered by country, so the groups are not sorted
+    grouped_data = (
+        data.drop(columns=['Lat', 'Long'])
+        .groupby('Country/Region', sort=False)
+        .sum(numeric_only=True)
+    )
     grouped_data = grouped_data[~grouped_data.index.isin(data_to_drop)]
-    return grouped_data
+    # The values are stored in a single C ordered float32 array, so that the time
+    # series of each country is contiguous and the values take up half the memory
+    return pd.DataFrame(
+        np.ascontiguousarray(grouped_data.to_numpy(dtype=np.float32)),
+        index=grouped_data.index,
+        columns=grouped_data.columns,
+    )
 
 
-@dataclass
 class LatestCovidData:
     """
-    A class holding the latest COVID cases, deaths and recoveries data
+    A class holding the latest COVID cases, deaths, recoveries and testing data. Each
+    dataset is only loaded and processed when it is first accessed.
+    """
+    @cached_property
+    def cases_data(self) -> pd.DataFrame:
+        return preprocess_covid_data(fetch_latest_cases_data())
+
+    @cached_property
+    def deaths_data(self) -> pd.DataFrame:
+        return preprocess_covid_data(fetch_latest_deaths_data())
+
+    @cached_property
+    def recovered_data(self) -> pd.DataFrame:
+        return preprocess_covid_data(fetch_latest_recovered_data())
+
+    @cached_property
+    def active_data(self) -> pd.DataFrame:
+        cases_data = self.cases_data
+        other_data = [self.deaths_data, self.recovered_data]
+        if not all(
+            covid_data.index.equals(cases_data.index)
+            and covid_data.columns.equals(cases_data.columns)
+            for covid_data in other_data
+        ):
+            return cases_data - (other_data[0] + other_data[1])
+        # The datasets usually have the same countries and dates, in which case the
+        # active cases are calculated on the numpy values without aligning them
+        deaths_values, recovered_values = (
+            covid_data.to_numpy() for covid_data in other_data
+        )
+        active_values = np.add(deaths_values, recovered_values)
+        np.subtract(cases_data.to_numpy(), active_values, out=active_values)
+        return pd.DataFrame(
+            active_values,
+            index=cases_data.index,
+            columns=cases_data.columns,
+        )
+
+    @cached_property
+    def testing_data(self) -> pd.DataFrame:
+        return get_testing_data()
+
+
+@lru_cache(maxsize=1)
+def get_latest_covid_data() -> LatestCovidData:
+    """
+    Gets the holder of the latest COVID data, which is shared by all callers so that
+    each dataset is only loaded once
+
+    Returns
+    -------
+    LatestCovidData
+        The holder of the latest COVID data
     """
-    cases_data: pd.DataFrame = preprocess_covid_data(fetch_latest_cases_data())
-    deaths_data: pd.DataFrame = preprocess_covid_data(fetch_latest_deaths_data())
-    recovered_data: pd.DataFrame = preprocess_covid_data(fetch_latest_recovered_data())
-    active_data: pd.DataFrame = cases_data - (deaths_data + recovered_data)
-    testing_data: pd.DataFrame = get_testing_data()
+    return LatestCovidData()
 
 
 @lru_cache(maxsize=1)
@@ -142,30 +271,43 @@ def fetch_population_data() -> pd.DataFrame:
         '/Users/emielzyde/Downloads/API_SP.POP.TOTL_DS2_en_csv_v3_988606.csv'
     )
 
-    # Apply processing to the country names
-    population_data['Country Name'] = population_data['Country Name'].apply(
-        lambda x: x.split(',')[0]
-        if len(x.split(',')) > 1 and x.split(',')[1] == ' The' else x
-    )
-    population_data['Country Name'] = population_data['Country Name'].apply(
-        lambda x: x.replace('St.', 'Saint') if 'St.' in x else x
-    )
-    population_data['Country Name'] = (
-        population_data['Country Name']
-        .apply(lambda country_name: country_name_mapper.get(country_name, country_name))
+    # Apply processing to the country names (e.g. Bahamas, The to Bahamas)
+    country_names = population_data['Country Name']
+    country_name_parts = country_names.str.split(',')
+    country_names = country_names.where(
+        country_name_parts.str[1] != ' The',
+        country_name_parts.str[0],
     )
+    country_names = country_names.str.replace('St.', 'Saint', regex=False)
+    population_data['Country Name'] = map_country_names(country_names)
     # Get the latest data (2018) and convert to millions
     population_data = population_data[['Country Name', '2018']]
     population_data['2018'] /= 1000000
     return population_data
 
 
+@lru_cache(maxsize=1)
+def get_population_by_country() -> pd.Series:
+    """
+    Gets the processed World Bank population data (in millions) as a series indexed
+    by the country names. Only the first figure is kept for any country which
+    appears more than once.
+
+    Returns
+    -------
+    pd.Series
+        The population of each country in millions
+    """
+    population_data = fetch_population_data().set_index('Country Name')['2018']
+    return population_data[~population_data.index.duplicated()]
+
+
 def extract_matching_population_data(
     covid_data: Union[pd.DataFrame, pd.Series],
-) -> Union[pd.DataFrame, pd.Series]:
+) -> Union[pd.Series, float]:
     """
-    Filters the population data so that it only includes the data for countries which
-    are present in the COVID data
+    Extracts the population data for the countries which are present in the COVID
+    data
 
     Parameters
     ----------
@@ -174,20 +316,17 @@ def extract_matching_population_data(
 
     Returns
     -------
-    Union[pd.DataFrame, pd.Series]
-        The filtered population data
+    Union[pd.Series, float]
+        The population data aligned with the countries in the COVID data (which is
+        NaN for countries without population data), or the population of the
+        country if the COVID data is a series
     """
-    population_data = fetch_population_data()
+    population_by_country = get_population_by_country()
     if isinstance(covid_data, pd.Series):
-        return (
-            population_data[
-                population_data['Country Name'] == covid_data.name
-            ]['2018']
-            .values[0]
-        )
-
-    population_data = (
-        population_data[population_data['Country Name'].isin(covid_data.index.unique())]
-    )
-    population_data = population_data.set_index('Country Name')
-    return population_data
+        return population_by_country.loc[covid_data.name]
+    # The grouped COVID data has one row per country, so the index can usually be used
+    # as it is. This also gives the population data the same order as the COVID data.
+    countries = covid_data.index
+    if not countries.is_unique:
+        countries = countries.unique()
+    return population_by_country.reindex(countries)
@@ -1,11 +1,11 @@
-import datetime as dt
 from dataclasses import dataclass
-from typing import List, Optional
+from typing import List, Optional, Tuple, Union
 
 import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
-from sklearn.mixture import GaussianMixture
+
+from .numba_utils import NUMBA_AVAILABLE, njit, prange
 
 
 @dataclass
@@ -13,7 +13,7 @@ class GaussianMixtureData:
     """
     Holds the data associated with one component of a Gaussian mixture model
     """
-    date_list: List[str]
+    date_list: Union[pd.DatetimeIndex, np.ndarray]
     covid_data: np.ndarray
 
 
@@ -23,9 +23,9 @@ class PlottingData:
     Contains the data needed to plot the peak and non-peak data as per the Gaussian
     mixture model.
     """
-    full_date_list: List[str]
+    full_date_list: pd.DatetimeIndex
     full_covid_data_list: np.ndarray
-    state_1_date_list: List[str]
+    state_1_date_list: np.ndarray
     state_1_covid_data_list: np.ndarray
     class_0_plot_name: str
     class_1_plot_name: str
@@ -48,26 +48,427 @@ def add_gaps_for_non_consecutive_dates(
     -------
     GaussianMixtureData
         The dates for the Gaussian mixture component, with spaces where there were gaps
-        in the dates
+        in the dates. The dates are labelled as in the JHU CSSE data (e.g. 3/1/20).
     """
-    date_list = gaussian_mixture_data.date_list
+    date_list = pd.DatetimeIndex(gaussian_mixture_data.date_list)
     covid_data = gaussian_mixture_data.covid_data
-    date_list_with_spaces, covid_data_with_spaces = [date_list[0]], [covid_data[0]]
-    for index, (date, prev_date) in enumerate(zip(date_list[1:], date_list[:-1])):
-        converted_date = dt.datetime.strptime(date, "%m/%d/%y")
-        converted_prev_date = dt.datetime.strptime(prev_date, "%m/%d/%y")
-        if not converted_date - dt.timedelta(1) == converted_prev_date:
-            date_list_with_spaces.append('')
-            covid_data_with_spaces.append('')
-        date_list_with_spaces.append(date)
-        covid_data_with_spaces.append(covid_data[index + 1])
+    # The dates are plotted as labels (a category axis), where the spaces break the
+    # lines between the runs of consecutive dates
+    date_labels = np.asarray(date_list.strftime('%-m/%-d/%y'), dtype=object)
+    # The dates are converted to days, and a space is inserted before every date
+    # which does not directly follow the previous date
+    dates = date_list.values.astype('datetime64[D]')
+    is_after_gap = np.zeros(len(dates), dtype=np.int64)
+    is_after_gap[1:] = np.diff(dates) != np.timedelta64(1, 'D')
+    # The peak is often a single run of consecutive dates, which needs no spaces
+    if not is_after_gap.any():
+        return GaussianMixtureData(
+            date_labels,
+            np.asarray(covid_data, dtype=object),
+        )
+    # Each value moves along by the number of spaces inserted before it, so the
+    # output arrays are allocated once and filled in a single assignment
+    positions = np.arange(len(dates)) + np.cumsum(is_after_gap)
+    num_values = len(dates) + is_after_gap.sum()
+    date_list_with_spaces = np.full(num_values, '', dtype=object)
+    date_list_with_spaces[positions] = date_labels
+    covid_data_with_spaces = np.full(num_values, '', dtype=object)
+    covid_data_with_spaces[positions] = np.asarray(covid_data, dtype=object)
     return GaussianMixtureData(date_list_with_spaces, covid_data_with_spaces)
 
 
+@njit(cache=True)
+def initialise_responsibilities(
+    values: np.ndarray,
+    num_components: int,
+    max_iter: int = 100,
+) -> np.ndarray:
+    """
+    Initialises the responsibilities of the mixture components by clustering the
+    values with (1D) k-means, with the centres initially spread evenly between the
+    minimum and the maximum value
+
+    Parameters
+    ----------
+    values
+        The values to which the mixture model is fitted
+    num_components
+        The number of mixture components
+    max_iter
+        The maximum number of k-means iterations
+
+    Returns
+    -------
+    np.ndarray
+        An array of shape (number of values, number of components), where each row
+        is one-hot encoded with the cluster of the value
+    """
+    num_values = values.shape[0]
+    centres = np.linspace(values.min(), values.max(), num_components)
+    labels = np.full(num_values, -1)
+    for _ in range(max_iter):
+        changed = False
+        for t in range(num_values):
+            nearest = 0
+            for m in range(1, num_components):
+                if abs(values[t] - centres[m]) < abs(values[t] - centres[nearest]):
+                    nearest = m
+            if nearest != labels[t]:
+                labels[t] = nearest
+                changed = True
+        if not changed:
+            break
+        for m in range(num_components):
+            total, count = 0.0, 0
+            for t in range(num_values):
+                if labels[t] == m:
+                    total += values[t]
+                    count += 1
+            if count > 0:
+                centres[m] = total / count
+
+    responsibilities = np.zeros((num_values, num_components))
+    for t in range(num_values):
+        responsibilities[t, labels[t]] = 1.0
+    return responsibilities
+
+
+@njit(cache=True, fastmath=True)
+def gaussian_expectation_step(
+    values: np.ndarray,
+    means: np.ndarray,
+    variances: np.ndarray,
+    weights: np.ndarray,
+) -> Tuple[np.ndarray, float]:
+    """
+    Performs the expectation step of the EM algorithm, i.e. calculates the
+    responsibility of component m for value x_t as
+    phi_m * N(x_t | mu_m, sigma_m) / sum_r phi_r * N(x_t | mu_r, sigma_r),
+    where phi are the weights, mu the means and sigma the variances of the components
+
+    Parameters
+    ----------
+    values
+        The values to which the mixture model is fitted
+    means
+        The means of the mixture components
+    variances
+        The variances of the mixture components
+    weights
+        The weights of the mixture components
+
+    Returns
+    -------
+    Tuple[np.ndarray, float]
+        The responsibilities, with shape (number of values, number of components),
+        and the mean log-likelihood of the values
+    """
+    num_values = values.shape[0]
+    num_components = means.shape[0]
+    responsibilities = np.empty((num_values, num_components))
+    log_likelihood = 0.0
+    for t in range(num_values):
+        # The densities are calculated in log space (and shifted by the largest one)
+        # so that values far away from all components do not underflow to zero
+        max_log_density = 0.0
+        for m in range(num_components):
+            difference = values[t] - means[m]
+            log_density = np.log(weights[m]) - 0.5 * (
+                np.log(2 * np.pi * variances[m])
+                + difference * difference / variances[m]
+            )
+            responsibilities[t, m] = log_density
+            if m == 0 or log_density > max_log_density:
+                max_log_density = log_density
+        total = 0.0
+        for m in range(num_components):
+            responsibilities[t, m] = np.exp(responsibilities[t, m] - max_log_density)
+            total += responsibilities[t, m]
+        for m in range(num_components):
+            responsibilities[t, m] /= total
+        log_likelihood += max_log_density + np.log(total)
+    return responsibilities, log_likelihood / num_values
+
+
+@njit(cache=True, fastmath=True)
+def gaussian_maximisation_step(
+    values: np.ndarray,
+    responsibilities: np.ndarray,
+    reg_covar: float,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Performs the maximisation step of the EM algorithm, i.e. updates the means,
+    variances and weights of the mixture components from the responsibilities
+
+    Parameters
+    ----------
+    values
+        The values to which the mixture model is fitted
+    responsibilities
+        The responsibilities, with shape (number of values, number of components)
+    reg_covar
+        A non-negative regularisation added to the variances, which ensures that they
+        are positive
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray, np.ndarray]
+        The means, variances and weights of the mixture components
+    """
+    num_values, num_components = responsibilities.shape
+    means = np.empty(num_components)
+    variances = np.empty(num_components)
+    weights = np.empty(num_components)
+    for m in range(num_components):
+        # A small constant avoids dividing by zero for empty components
+        total = 10 * np.finfo(np.float64).eps
+        weighted_sum = 0.0
+        for t in range(num_values):
+            total += responsibilities[t, m]
+            weighted_sum += responsibilities[t, m] * values[t]
+        mean = weighted_sum / total
+        squared_deviations = 0.0
+        for t in range(num_values):
+            difference = values[t] - mean
+            squared_deviations += responsibilities[t, m] * difference * difference
+        means[m] = mean
+        variances[m] = squared_deviations / total + reg_covar
+        weights[m] = total / num_values
+    return means, variances, weights
+
+
+@njit(cache=True)
+def fit_predict_gaussian_mixture(
+    values: np.ndarray,
+    num_components: int = 2,
+    max_iter: int = 50,
+    tol: float = 1e-3,
+    reg_covar: float = 1e-5,
+) -> np.ndarray:
+    """
+    Fits a (1D) Gaussian mixture model to the values using the EM algorithm and
+    predicts the component of each value
+
+    Parameters
+    ----------
+    values
+        The values to which the mixture model is fitted
+    num_components
+        The number of mixture components
+    max_iter
+        The maximum number of EM iterations
+    tol
+        The EM iterations stop when the change in the mean log-likelihood is below
+        this threshold
+    reg_covar
+        A non-negative regularisation added to the variances
+
+    Returns
+    -------
+    np.ndarray
+        The index of the most likely component for each value
+    """
+    responsibilities = initialise_responsibilities(values, num_components)
+    means, variances, weights = gaussian_maximisation_step(
+        values,
+        responsibilities,
+        reg_covar,
+    )
+    previous_log_likelihood = 0.0
+    for iteration in range(max_iter):
+        responsibilities, log_likelihood = gaussian_expectation_step(
+            values,
+            means,
+            variances,
+            weights,
+        )
+        means, variances, weights = gaussian_maximisation_step(
+            values,
+            responsibilities,
+            reg_covar,
+        )
+        if iteration > 0 and abs(log_likelihood - previous_log_likelihood) < tol:
+            break
+        previous_log_likelihood = log_likelihood
+
+    # A final expectation step ensures that the labels match the fitted parameters
+    responsibilities, _ = gaussian_expectation_step(values, means, variances, weights)
+    labels = np.empty(values.shape[0], dtype=np.int64)
+    for t in range(values.shape[0]):
+        labels[t] = np.argmax(responsibilities[t])
+    return labels
+
+
+@njit(cache=True, parallel=True)
+def fit_predict_gaussian_mixtures(
+    series: np.ndarray,
+    lengths: np.ndarray,
+    num_components: int = 2,
+    max_iter: int = 50,
+    tol: float = 1e-3,
+    reg_covar: float = 1e-5,
+) -> np.ndarray:
+    """
+    Fits a separate (1D) Gaussian mixture model to each of the series in parallel and
+    predicts the component of each value
+
+    Parameters
+    ----------
+    series
+        A 2D array where row i contains the lengths[i] values of the ith series,
+        followed by padding
+    lengths
+        The number of values in each series
+    num_components
+        The number of mixture components
+    max_iter
+        The maximum number of EM iterations
+    tol
+        The EM iterations stop when the change in the mean log-likelihood is below
+        this threshold
+    reg_covar
+        A non-negative regularisation added to the variances
+
+    Returns
+    -------
+    np.ndarray
+        An array with the same shape as the series, containing the index of the most
+        likely component for each value (and -1 for the padding)
+    """
+    labels = np.full(series.shape, -1, dtype=np.int64)
+    for i in prange(series.shape[0]):
+        labels[i, :lengths[i]] = fit_predict_gaussian_mixture(
+            series[i, :lengths[i]],
+            num_components,
+            max_iter,
+            tol,
+            reg_covar,
+        )
+    return labels
+
+
+def fit_predict_gaussian_mixtures_batched(
+    series: np.ndarray,
+    lengths: np.ndarray,
+    num_components: int = 2,
+    max_iter: int = 50,
+    tol: float = 1e-3,
+    reg_covar: float = 1e-5,
+) -> np.ndarray:
+    """
+    Fits a separate (1D) Gaussian mixture model to each of the series and predicts
+    the component of each value. This follows the same steps as
+    fit_predict_gaussian_mixtures, but each step is applied to all the series at once
+    with numpy operations, so it is used when numba is not available.
+
+    Parameters
+    ----------
+    series
+        A 2D array where row i contains the lengths[i] values of the ith series,
+        followed by padding
+    lengths
+        The number of values in each series
+    num_components
+        The number of mixture components
+    max_iter
+        The maximum number of EM iterations
+    tol
+        The EM iterations stop when the change in the mean log-likelihood is below
+        this threshold
+    reg_covar
+        A non-negative regularisation added to the variances
+
+    Returns
+    -------
+    np.ndarray
+        An array with the same shape as the series, containing the index of the most
+        likely component for each value (and -1 for the padding)
+    """
+    # The arrays below have shape (series, values, components), where the padding is
+    # masked out of all the sums
+    is_value = np.arange(series.shape[1]) < lengths[:, None]
+    values = np.where(is_value, series, 0.0)[:, :, None]
+    components = np.arange(num_components)
+
+    # Initialise the responsibilities with k-means, as in initialise_responsibilities
+    minimums = np.where(is_value, series, np.inf).min(axis=1, initial=np.inf)
+    maximums = np.where(is_value, series, -np.inf).max(axis=1, initial=-np.inf)
+    centres = minimums[:, None] + (maximums - minimums)[:, None] * np.linspace(
+        0,
+        1,
+        num_components,
+    )
+    labels = np.full(series.shape, -1)
+    for _ in range(100):
+        nearest = np.abs(values - centres[:, None, :]).argmin(axis=2)
+        if not ((nearest != labels) & is_value).any():
+            break
+        labels = nearest
+        is_member = (labels[:, :, None] == components) & is_value[:, :, None]
+        counts = is_member.sum(axis=1)
+        centres = np.where(
+            counts > 0,
+            (is_member * values).sum(axis=1) / np.maximum(counts, 1),
+            centres,
+        )
+    responsibilities = (
+        (labels[:, :, None] == components) & is_value[:, :, None]
+    ).astype(float)
+
+    def maximisation_step(responsibilities):
+        totals = responsibilities.sum(axis=1) + 10 * np.finfo(np.float64).eps
+        means = (responsibilities * values).sum(axis=1) / totals
+        squared_deviations = (values - means[:, None, :]) ** 2
+        variances = (
+            (responsibilities * squared_deviations).sum(axis=1) / totals + reg_covar
+        )
+        return means, variances, totals / lengths[:, None]
+
+    def expectation_step(means, variances, weights):
+        log_densities = np.log(weights[:, None, :]) - 0.5 * (
+            np.log(2 * np.pi * variances[:, None, :])
+            + (values - means[:, None, :]) ** 2 / variances[:, None, :]
+        )
+        max_log_densities = log_densities.max(axis=2, keepdims=True)
+        densities = np.exp(log_densities - max_log_densities)
+        totals = densities.sum(axis=2, keepdims=True)
+        log_likelihoods = np.where(
+            is_value,
+            (max_log_densities + np.log(totals))[:, :, 0],
+            0.0,
+        ).sum(axis=1) / lengths
+        return densities / totals * is_value[:, :, None], log_likelihoods
+
+    # The parameters of a series are no longer updated once its EM iterations have
+    # converged
+    means, variances, weights = maximisation_step(responsibilities)
+    previous_log_likelihoods = np.zeros(len(series))
+    is_active = np.ones(len(series), dtype=bool)
+    for iteration in range(max_iter):
+        responsibilities, log_likelihoods = expectation_step(means, variances, weights)
+        updated_means, updated_variances, updated_weights = maximisation_step(
+            responsibilities,
+        )
+        means = np.where(is_active[:, None], updated_means, means)
+        variances = np.where(is_active[:, None], updated_variances, variances)
+        weights = np.where(is_active[:, None], updated_weights, weights)
+        has_converged = (
+            (iteration > 0)
+            & (np.abs(log_likelihoods - previous_log_likelihoods) < tol)
+        )
+        previous_log_likelihoods = log_likelihoods
+        is_active &= ~has_converged
+        if not is_active.any():
+            break
+
+    responsibilities, _ = expectation_step(means, variances, weights)
+    return np.where(is_value, responsibilities.argmax(axis=2), -1)
+
+
 def predict_peaks_using_gmm(
     covid_data: pd.DataFrame,
     threshold: int = 10,
-    country_set: Optional[List[str]] = None,
+    country_set: Optional[Tuple[str, ...]] = None,
 ) -> List[PlottingData]:
     """
     Predicts the peak and non-peak split for each country using a Gaussian mixture model
@@ -80,7 +481,7 @@ def predict_peaks_using_gmm(
         The threshold used to adjust the data. If this is 10, the data will be
         normalised relative to the 10th death/infection/recovery
     country_set
-        An optional list of countries that should be displayed
+        An optional tuple of countries that should be displayed
 
     Returns
     -------
@@ -88,30 +489,58 @@ def predict_peaks_using_gmm(
         A list of PlottingData objects which contain the data required to construct
         the plot for each country
     """
-    plotting_data_list = []
-    # Set up a GMM with 2 components - peak and non-peak
-    gmm = GaussianMixture(n_components=2)
-
+    # The dates are parsed once for all the countries. set_axis returns a new
+    # dataframe, so the (possibly cached) COVID data is not modified.
+    covid_data = covid_data.set_axis(
+        pd.to_datetime(covid_data.columns, format='%m/%d/%y', cache=True),
+        axis=1,
+    )
+    # The countries are looked up in a set, since they are tested for every country
+    if country_set:
+        country_set = frozenset(country_set)
+    country_data_list = []
     for country in covid_data.index:
         if country_set and country not in country_set:
             continue
         country_data = covid_data.loc[country].dropna()
         first_threshold_exceeding_index = (
-            pd.to_datetime(country_data[country_data >= threshold].index[0])
+            country_data[country_data >= threshold].index[0]
         )
         country_data = country_data[
-            pd.to_datetime(country_data.index) >= first_threshold_exceeding_index
+            country_data.index >= first_threshold_exceeding_index
         ]
 
         if len(country_data) < 5:
             continue
-        # Reshape the values into a 2D numpy array (required by the GMM models)
-        covid_values = np.reshape(country_data.values, (-1, 1))
-        predictions = gmm.fit_predict(covid_values)
+        country_data_list.append(country_data)
 
-        class_one_mean = np.mean(country_data[predictions == 1])
-        class_zero_mean = np.mean(country_data[predictions == 0])
-        peak = 1 if class_one_mean > class_zero_mean else 0
+    # Fit a GMM with 2 components - peak and non-peak - for all countries at once. The
+    # data for the countries is padded so that it can be stored in a single array.
+    lengths = np.array(
+        [len(country_data) for country_data in country_data_list],
+        dtype=np.int64,
+    )
+    series = np.zeros((len(country_data_list), lengths.max(initial=0)))
+    for idx, country_data in enumerate(country_data_list):
+        series[idx, :lengths[idx]] = country_data.values
+    if NUMBA_AVAILABLE:
+        labels = fit_predict_gaussian_mixtures(series, lengths, num_components=2)
+    else:
+        labels = fit_predict_gaussian_mixtures_batched(
+            series,
+            lengths,
+            num_components=2,
+        )
+
+    plotting_data_list = []
+    for idx, country_data in enumerate(country_data_list):
+        country = country_data.name
+        predictions = labels[idx, :lengths[idx]]
+        # The class means are compared from the sums and counts of each class, which
+        # are found in one pass (cross-multiplying the counts avoids the divisions)
+        class_sums = np.bincount(predictions, weights=country_data.values, minlength=2)
+        class_counts = np.bincount(predictions, minlength=2)
+        peak = int(class_sums[1] * class_counts[0] > class_sums[0] * class_counts[1])
         class_1_plot_name = f"{country} - {'Peak' if peak == 1 else 'Off-peak'}"
         class_0_plot_name = f"{country} - {'Peak' if peak == 0 else 'Off-peak'}"
 
@@ -119,9 +548,10 @@ def predict_peaks_using_gmm(
         # with all the data is plotted and then a scatter plot with the class 1 data
         # is plotted. To ensure that the scatter plot is correct, the missing data in
         # the class 1 data need to be filled with spaces.
+        is_class_one = predictions == 1
         component_one_data = GaussianMixtureData(
-            country_data.index[predictions == 1],
-            country_data[predictions == 1].values
+            country_data.index[is_class_one],
+            country_data.values[is_class_one],
         )
         adj_component_one_data = add_gaps_for_non_consecutive_dates(component_one_data)
 
@@ -158,28 +588,39 @@ def plot_peaks(
     go.Figure
         The figure with the peaks and off-peaks identified by the Gaussian mixture model
     """
-    figure = go.Figure()
-    plot_order_indices = np.argsort([
-        pd.to_datetime(plot_data.full_date_list[0]) for plot_data in plotting_data_list
+    # The date lists are already datetime indices, so the first dates are compared as
+    # datetime64 values without parsing them again
+    first_dates = pd.DatetimeIndex([
+        plot_data.full_date_list[0] for plot_data in plotting_data_list
     ])
-    plotting_data_list = [plotting_data_list[idx] for idx in list(plot_order_indices)]
+    plot_order_indices = np.argsort(first_dates.values)
+    plotting_data_list = [plotting_data_list[idx] for idx in plot_order_indices]
+    # The traces are passed as plain dictionaries when the figure is constructed, so
+    # the figure is built (and validated) once rather than once per trace. The dates
+    # are plotted as labels (as in the JHU CSSE data), which gives a category axis.
+    traces = []
     for plot_data in plotting_data_list:
-        figure.add_trace(go.Scatter(
-            x=plot_data.full_date_list,
+        traces.append(dict(
+            type='scatter',
+            x=plot_data.full_date_list.strftime('%-m/%-d/%y'),
             y=plot_data.full_covid_data_list,
             name=plot_data.class_0_plot_name,
             mode='lines',
             connectgaps=False,
         ))
-        figure.add_trace(go.Scatter(
+        traces.append(dict(
+            type='scatter',
             x=plot_data.state_1_date_list,
             y=plot_data.state_1_covid_data_list,
             name=plot_data.class_1_plot_name,
             connectgaps=False,
-            mode='lines'
+            mode='lines',
         ))
-    figure.update_layout(
-        title=f'Predictions of the peaks in various countries<br>{y_axis_title}',
+    figure = go.Figure(
+        data=traces,
+        layout={
+            'title': f'Predictions of the peaks in various countries<br>{y_axis_title}',
+        },
     )
 
     return figure
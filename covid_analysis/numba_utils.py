@@ -0,0 +1,16 @@
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    # Without numba, the kernels decorated with njit run as plain Python functions
+    NUMBA_AVAILABLE = False
+    prange = range
+
+    def njit(*args, **kwargs):
+        """
+        Stand-in for numba.njit which returns the decorated function unchanged. This
+        supports both the @njit and the @njit(...) forms of the decorator.
+        """
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda func: func
@@ -1,6 +1,11 @@
+from functools import lru_cache
+
 from .config_utils import ProcessingConfigHolder
 
 
+# The processing config is hashable and the plots only use a handful of combinations
+# of data types and configs, so the titles are cached
+@lru_cache(maxsize=32)
 def construct_y_axis_title(
     covid_data_type: str,
     processing_config: ProcessingConfigHolder,
@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
 
@@ -25,32 +26,32 @@ def analyse_weekend_effects(covid_data: pd.DataFrame) -> pd.DataFrame:
         between the percentage of, e.g., deaths reported on each day and the percentage
         of deaths that would be expected if they were spread uniformly across the week
     """
-    processing_config = ProcessingConfigHolder()
-    processing_config.get_rolling_average = False
-    processing_config.normalise_by_population = False
+    processing_config = ProcessingConfigHolder(
+        get_rolling_average=False,
+        normalise_by_population=False,
+    )
     covid_data = process_covid_data(covid_data, processing_config)
 
-    # Covert the column names from dates to the weekdays they represent
-    covid_data.columns = [
-        col.day_name()
-        for col in pd.to_datetime(covid_data.columns)
-    ]
-    daily_data_list = []
-    for day in WEEKDAYS:
-        daily_data = covid_data.loc[:, covid_data.columns == day].sum(axis=1)
-        daily_data_list.append(daily_data)
-    summed_data = pd.concat(daily_data_list, axis=1)
-    summed_data.columns = WEEKDAYS
+    # Bucket the columns by the weekdays of their dates, so that the figures for each
+    # weekday are gathered with integer indexing. The epoch (1/1/70) was a Thursday,
+    # so adding 4 to the days since the epoch gives Sunday as day 0.
+    dates = pd.to_datetime(covid_data.columns, format='%m/%d/%y', cache=True)
+    days_since_epoch = dates.values.astype('datetime64[D]').astype(np.int64)
+    weekdays = (days_since_epoch + 4) % 7
+    values = covid_data.to_numpy()
+    summed_data = pd.DataFrame(
+        np.column_stack([
+            np.nansum(values[:, np.flatnonzero(weekdays == day)], axis=1)
+            for day in range(len(WEEKDAYS))
+        ]),
+        index=covid_data.index,
+        columns=WEEKDAYS,
+    )
     normalised_data = summed_data.divide(
         summed_data.sum(axis=1),
         axis=0,
     )
-    uniform_series = pd.Series([1/7] * 7)
-    uniform_series.index = WEEKDAYS
-    weekend_effect_data = (
-        normalised_data
-        .subtract(uniform_series, axis=1) * 100
-    )
+    weekend_effect_data = (normalised_data - 1/7) * 100
     return weekend_effect_data
 
 
@@ -78,8 +79,8 @@ def plot_weekend_effect_data(
     go.Figure
         A figure showing the weekend effect data for the selected country
     """
-    country_data = weekend_effect_data[weekend_effect_data.index == country]
-    country_data = country_data.T.squeeze()
+    # An unknown country gives an all-NaN row (and an empty chart) rather than an error
+    country_data = weekend_effect_data.reindex([country]).iloc[0]
     figure = go.Figure()
     figure.add_trace(go.Bar(
         x=country_data.index,
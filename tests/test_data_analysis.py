@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from covid_analysis.data_analysis import (
+    normalise_by_population_count,
+    process_covid_values,
+)
+
+
+def make_covid_data() -> pd.DataFrame:
+    """
+    Creates cumulative COVID figures for a few countries, including a country whose
+    figures start with missing values and a country with a missing value in between
+    """
+    rng = np.random.default_rng(0)
+    values = np.cumsum(rng.integers(0, 50, (4, 10)), axis=1).astype(np.float32)
+    values[1, :3] = np.nan
+    values[2, 5] = np.nan
+    values[3] = np.nan
+    return pd.DataFrame(
+        values,
+        index=['Belgium', 'Fiji', 'Italy', 'US'],
+        columns=pd.date_range('2020-03-01', periods=10).strftime('%-m/%-d/%y'),
+    )
+
+
+def process_with_pandas(
+    covid_data: pd.DataFrame,
+    threshold: float,
+    get_daily_change: bool,
+    num_rolling_average_days: int,
+) -> pd.DataFrame:
+    # The pandas steps that process_covid_values replaces
+    covid_data = covid_data.astype(np.float64)
+    covid_data = covid_data.where(covid_data >= threshold)
+    if get_daily_change:
+        covid_data = covid_data.diff(axis=1)
+    return covid_data.T.rolling(num_rolling_average_days).mean().T
+
+
+@pytest.mark.parametrize('threshold', [-np.inf, 100])
+@pytest.mark.parametrize('get_daily_change', [False, True])
+@pytest.mark.parametrize('num_rolling_average_days', [1, 3, 12])
+def test_process_covid_values_matches_pandas(
+    threshold,
+    get_daily_change,
+    num_rolling_average_days,
+):
+    covid_data = make_covid_data()
+    values = covid_data.to_numpy()
+    processed_values = np.empty_like(values)
+    process_covid_values(
+        values,
+        processed_values,
+        threshold,
+        get_daily_change,
+        num_rolling_average_days,
+    )
+    expected_data = process_with_pandas(
+        covid_data,
+        threshold,
+        get_daily_change,
+        num_rolling_average_days,
+    )
+    np.testing.assert_allclose(
+        processed_values,
+        expected_data.to_numpy(),
+        rtol=1e-6,
+        equal_nan=True,
+    )
+
+    # The processed figures are then scaled to figures per million people
+    population_data = pd.Series(
+        [11.4, 0.9, 60.4],
+        index=['Belgium', 'Fiji', 'Italy'],
+    )
+    normalised_data = normalise_by_population_count(
+        pd.DataFrame(
+            processed_values,
+            index=covid_data.index,
+            columns=covid_data.columns,
+        ),
+        population_data,
+    )
+    expected_population = np.array([11.4, 0.9, 60.4, np.nan])
+    np.testing.assert_allclose(
+        normalised_data.to_numpy(),
+        expected_data.to_numpy() / expected_population[:, None],
+        rtol=1e-6,
+        equal_nan=True,
+    )
@@ -0,0 +1,79 @@
+import numpy as np
+
+from covid_analysis.gmm_modelling import (
+    fit_predict_gaussian_mixture,
+    fit_predict_gaussian_mixtures,
+    fit_predict_gaussian_mixtures_batched,
+)
+
+
+def make_two_cluster_values(seed: int, num_values: int = 60):
+    """
+    Creates values drawn from two well separated clusters (in a random order),
+    together with the index of the cluster of each value
+    """
+    rng = np.random.default_rng(seed)
+    true_labels = rng.permutation(np.arange(num_values) % 2)
+    values = np.where(
+        true_labels == 1,
+        rng.normal(1000, 20, num_values),
+        rng.normal(50, 5, num_values),
+    )
+    return values, true_labels
+
+
+def assert_same_clusters(labels: np.ndarray, true_labels: np.ndarray):
+    # The components may be numbered either way round
+    assert (
+        np.array_equal(labels, true_labels)
+        or np.array_equal(labels, 1 - true_labels)
+    )
+
+
+def test_fit_predict_gaussian_mixture_recovers_separated_clusters():
+    values, true_labels = make_two_cluster_values(seed=0)
+    labels = fit_predict_gaussian_mixture(values, num_components=2)
+    assert_same_clusters(labels, true_labels)
+
+
+def test_fit_predict_gaussian_mixtures_recovers_separated_clusters():
+    lengths = np.array([60, 25, 40], dtype=np.int64)
+    series = np.zeros((len(lengths), lengths.max()))
+    all_true_labels = []
+    for idx, length in enumerate(lengths):
+        values, true_labels = make_two_cluster_values(seed=idx, num_values=length)
+        series[idx, :length] = values
+        all_true_labels.append(true_labels)
+
+    labels = fit_predict_gaussian_mixtures(series, lengths, num_components=2)
+    for idx, length in enumerate(lengths):
+        assert_same_clusters(labels[idx, :length], all_true_labels[idx])
+        # The padding after each series is not assigned to a component
+        assert (labels[idx, length:] == -1).all()
+
+
+def test_batched_gaussian_mixtures_match_kernel():
+    # The numpy version is only used without numba, so it must give the same labels
+    rng = np.random.default_rng(42)
+    lengths = rng.integers(5, 200, 20)
+    series = np.zeros((len(lengths), lengths.max()))
+    for idx, length in enumerate(lengths):
+        num_first_values = length // 2
+        series[idx, :num_first_values] = rng.normal(
+            rng.uniform(0, 5000),
+            rng.uniform(10, 800),
+            num_first_values,
+        )
+        series[idx, num_first_values:length] = rng.normal(
+            rng.uniform(0, 5000),
+            rng.uniform(10, 800),
+            length - num_first_values,
+        )
+
+    labels = fit_predict_gaussian_mixtures(series, lengths, num_components=2)
+    batched_labels = fit_predict_gaussian_mixtures_batched(
+        series,
+        lengths,
+        num_components=2,
+    )
+    np.testing.assert_array_equal(batched_labels, labels)